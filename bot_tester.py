@@ -1,14 +1,31 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import io
+import gzip
+import tempfile
 import csv
 import re
 import json
+import math
+import hashlib
+import sqlite3
+from contextlib import closing
+from functools import lru_cache
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
 import traceback
 
+try:
+    import orjson  # Optional: much faster JSON encoding and decoding
+except ImportError:
+    orjson = None
+
 # Page configuration
 st.set_page_config(
     page_title="Strategy Bot Query Tool",
@@ -36,20 +53,31 @@ with input_col1:
     base_url = st.text_input("Base URL", value="https://autotrial.microstrategy.com/MicroStrategyLibrary")
     project_id = st.text_input("Project ID", value="205BABE083484404399FBBA37BAA874A")
     bot_id = st.text_input("Bot ID", value="1DC776FB20744B85AFEE148D7C11C842")
+    submissions_per_minute = st.slider("Max questions submitted per minute", min_value=0, max_value=120, value=0,
+                                       help="Rate limit for question submissions to the bot API (0 = no limit)")
+    max_concurrent = st.number_input("Concurrent questions", min_value=1, max_value=16, value=4,
+                                     help="How many questions are submitted and polled at the same time")
+    ignore_cache = st.checkbox("Ignore cached answers", value=False,
+                               help="Ask the bot again even if an earlier run saved an answer (new answers are still saved)")
 
 with input_col2:
     # Authentication
     st.subheader("Authentication")
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
+    relogin_clicked = st.button("Re-login", help="Drop the saved session and log in again on the next run")
 
 # File upload
 st.subheader("Questions File")
 uploaded_file = st.file_uploader("Upload CSV file with questions", type="csv")
+compress_downloads = st.checkbox("Compress downloads (gzip)", value=False,
+                                 help="Download results as .csv.gz, which is much smaller for large runs")
 
 # Initialize session state for checkpointing
-if 'results_df' not in st.session_state:
-    st.session_state.results_df = None
+if 'results_columns' not in st.session_state:
+    st.session_state.results_columns = None  # Finished results as {column: list of values}, in question order
+if 'results_csv' not in st.session_state:
+    st.session_state.results_csv = None  # Spooled CSV file of the checkpointed rows
 if 'questions_processed' not in st.session_state:
     st.session_state.questions_processed = 0
 if 'total_questions' not in st.session_state:
@@ -58,6 +86,73 @@ if 'questions_list' not in st.session_state:
     st.session_state.questions_list = []
 if 'processing_active' not in st.session_state:
     st.session_state.processing_active = False
+if 'questions_file_id' not in st.session_state:
+    st.session_state.questions_file_id = None
+
+# Results columns, including the additional assessment columns
+COLUMNS = (
+    "Question",
+    "Answer",
+    "Insights",
+    "Interpretation",
+    "SQL",
+    "API Response Time (seconds)",
+    "Total Response Time (seconds)",
+    "Estimated Time to First Response (seconds)",
+    "Cached At",  # When a reused answer was saved; empty if the bot answered in this run
+    "Question Difficulty (1-5)",
+    "Pass/Fail",
+    "Answer Accuracy (1-5)"
+)
+
+# Timing columns keep full precision and are rounded when shown or exported
+TIME_COLUMNS = frozenset([
+    "API Response Time (seconds)",
+    "Total Response Time (seconds)",
+    "Estimated Time to First Response (seconds)"
+])
+
+# Columns shown on the page (the assessment columns are only in the download),
+# with timings shown to 2 decimals; the table is displayed without copying it
+DISPLAY_COLUMNS = tuple(c for c in COLUMNS if c not in ("Question Difficulty (1-5)", "Pass/Fail", "Answer Accuracy (1-5)"))
+DISPLAY_CONFIG = {column: st.column_config.NumberColumn(format="%.2f") for column in TIME_COLUMNS}
+
+# JSON helpers that use orjson when it is installed
+def json_loads(content):
+    """Decode JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def json_dumps(data):
+    """Encode JSON to UTF-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode("utf-8")
+
+# SQL complexity tiers, each fused into one case-insensitive pattern so a tier is a single scan
+# Very complex patterns (multiple joins, complex functions, subqueries, window functions)
+VERY_COMPLEX_SQL = re.compile("|".join([
+    r'with\s+.\s+as',        # CTE (Common Table Expressions)
+    r'over\s\(',              # Window functions
+    r'(select.+from.+)\s+select', # Subqueries
+    r'join.*join.*join',       # Multiple joins (3+)
+    r'case\s+when.*case\s+when', # Nested CASE statements
+    r'union|intersect|except'  # Set operations
+]), re.IGNORECASE)
+
+# Complex patterns (joins, aggregations, group by)
+COMPLEX_SQL = re.compile("|".join([
+    r'join',                   # Any kind of join
+    r'group\s+by',             # Grouping
+    r'having',                 # Having clause
+    r'order\s+by.*order\s+by', # Multiple order by clauses
+    r'distinct',               # Distinct operations
+    r'sum\(|avg\(|count\(|max\(|min\(' # Aggregations
+]), re.IGNORECASE)
+
+# SQL at least this long is classified without memoizing, so huge queries don't sit in the cache
+MAX_CACHED_SQL_LENGTH = 16384
 
 # Function to analyze SQL complexity and estimate latency
 def analyze_sql_complexity(sql_query):
@@ -73,148 +168,252 @@ def analyze_sql_complexity(sql_query):
     """
     if not sql_query or len(sql_query.strip()) < 10:
         return 0.5, "No SQL"  # No meaningful SQL
-        
-    # Convert to lowercase for easier pattern matching
-    sql_lower = sql_query.lower()
-    
-    # Very complex patterns (multiple joins, complex functions, subqueries, window functions)
-    very_complex_patterns = [
-        r'with\s+.\s+as',        # CTE (Common Table Expressions)
-        r'over\s\(',              # Window functions
-        r'(select.+from.+)\s+select', # Subqueries
-        r'join.*join.*join',       # Multiple joins (3+)
-        r'case\s+when.*case\s+when', # Nested CASE statements
-        r'union|intersect|except'  # Set operations
-    ]
-    
-    # Complex patterns (joins, aggregations, group by)
-    complex_patterns = [
-        r'join',                   # Any kind of join
-        r'group\s+by',             # Grouping
-        r'having',                 # Having clause
-        r'order\s+by.*order\s+by', # Multiple order by clauses
-        r'distinct',               # Distinct operations
-        r'sum\(|avg\(|count\(|max\(|min\(' # Aggregations
-    ]
-    
-    # Simple patterns (basic where clauses, single table, order by)
-    simple_patterns = [
-        r'where',                  # Where clause
-        r'order\s+by',             # Order by
-        r'limit',                  # Limit clause
-        r'select.*from'            # Basic select
-    ]
     
+    # Bots often return the same SQL for similar questions; very large
+    # queries are classified directly so they don't sit in the cache
+    if len(sql_query) < MAX_CACHED_SQL_LENGTH:
+        return classify_sql(sql_query)
+    return classify_sql.__wrapped__(sql_query)
+
+# Function to match SQL against the complexity tiers, memoized on the SQL text
+@lru_cache(maxsize=2048)
+def classify_sql(sql_query):
+    """Returns: (estimated latency in seconds, complexity label) for the first tier the SQL matches"""
     # Check for very complex patterns
-    for pattern in very_complex_patterns:
-        if re.search(pattern, sql_lower):
-            return 8.0, "Very Complex SQL"
-            
+    if VERY_COMPLEX_SQL.search(sql_query):
+        return 8.0, "Very Complex SQL"
+        
     # Check for complex patterns
-    for pattern in complex_patterns:
-        if re.search(pattern, sql_lower):
-            return 5.0, "Complex SQL"
-            
-    # If we've gotten here, it's either simple or has unusual patterns
-    # Let's check for simple patterns
-    for pattern in simple_patterns:
-        if re.search(pattern, sql_lower):
-            return 3.0, "Simple SQL"
-            
-    # Default to simple if we can't determine (but it has some SQL)
+    if COMPLEX_SQL.search(sql_query):
+        return 5.0, "Complex SQL"
+        
+    # Anything else with SQL (basic where, order by, limit, select...from) is simple
     return 3.0, "Simple SQL"
 
+# Token bucket rate limiter shared by the worker threads
+class RateLimiter:
+    def __init__(self, rate_per_minute, capacity=1):
+        self.interval = 60.0 / rate_per_minute  # Seconds to earn one token
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) / self.interval)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) * self.interval
+            time.sleep(delay)
+
+# Disk cache of bot responses so re-runs of the same questions skip the bot
+class ResponseCache:
+    def __init__(self, base_url, project_id, bot_id, username, path="bot_response_cache.db"):
+        self.path = path
+        # Answers are only reused for the same bot and user, since what the bot
+        # can see depends on the logged-in user's data permissions
+        self.scope = f"{base_url}|{project_id}|{bot_id}|{username}"
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, first_response_time REAL, total_response_time REAL, "
+                "cached_at REAL)"
+            )
+            # Caches written before cached_at was recorded
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+            if "cached_at" not in columns:
+                conn.execute("ALTER TABLE responses ADD COLUMN cached_at REAL")
+
+    def key(self, question_text):
+        """Hash of the bot scope and the normalized question text"""
+        normalized = " ".join(question_text.lower().split())
+        return hashlib.sha256(f"{self.scope}|{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, question_text):
+        """Return (response_data, time_to_first_response, total_response_time, cached_at) or None"""
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            row = conn.execute(
+                "SELECT response, first_response_time, total_response_time, cached_at FROM responses WHERE key = ?",
+                (self.key(question_text),)
+            ).fetchone()
+        if row is None:
+            return None
+        return json_loads(row[0]), row[1], row[2], row[3]
+
+    def set(self, question_text, response_data, first_response_time, total_response_time):
+        """Store a completed response"""
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, first_response_time, total_response_time, cached_at) VALUES (?, ?, ?, ?, ?)",
+                (self.key(question_text), json_dumps(response_data), first_response_time, total_response_time,
+                 time.time())
+            )
+
+# Function to read how long a throttled or unavailable server asked us to wait
+def retry_after_seconds(response, max_wait=10.0):
+    """
+    Parse the Retry-After header (seconds or an HTTP date), capped at max_wait
+    Returns: seconds to wait, or None if the header is missing or unreadable
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, min(seconds, max_wait))
+
 # Chatbot client class
 class ChatbotClient:
-    def __init__(self, base_url, bot_id, project_id):
+    # Fixed attribute set: smaller instances and faster attribute access in the polling loop
+    __slots__ = (
+        "base_url", "bot_id", "project_id", "session", "auth_token", "last_activity",
+        "_credentials", "_login_lock", "_questions_url", "_submit_headers", "_submit_payload_template"
+    )
+
+    def __init__(self, base_url, bot_id, project_id, pool_size=10):
         self.base_url = base_url
         self.bot_id = bot_id
         self.project_id = project_id
         self.session = requests.Session()
+        # Only failed connections are retried here, since nothing was sent yet. A resent
+        # submit could create a duplicate question, and a resent long poll would run past
+        # the poll timeout, so submit_question and poll_answer retry everything else
+        # themselves (including 429/503 responses, honouring Retry-After)
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=0,
+            backoff_factor=0.5,
+            raise_on_status=False
+        )
+        # Keep one pooled connection per concurrent question (each submits, then polls),
+        # so keep-alive connections are reused instead of re-handshaking
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update({"Content-Type": "application/json"})
         self.auth_token = None
         self.last_activity = time.time()
+        # Kept from the last login so an expired token can be renewed on a 401
+        self._credentials = None
+        self._login_lock = threading.Lock()
+        # Submission URL, headers and payload are the same for every question except the text
+        self._questions_url = f"{base_url}/api/questions"
+        self._submit_headers = {
+            "Prefer": "respond-async",
+            "X-MSTR-ProjectID": project_id
+        }
+        self._submit_payload_template = {
+            "textOnly": True,
+            "bots": ({"id": bot_id, "projectId": project_id},),
+            "history": ()
+        }
         
     def login(self, username, password):
-        """Authenticate and store token in session headers"""
+        """
+        Authenticate and store token in session headers
+        Raises on failure and shows nothing itself, since it also runs on worker threads;
+        callers report the error where it belongs
+        """
         url = f"{self.base_url}/api/auth/login"
         payload = {
             "username": username,
             "password": password
         }
         
+        response = self.session.post(url, data=json_dumps(payload), timeout=30)
+        response.raise_for_status()
+        
+        # Extract token from headers
+        self.auth_token = response.headers.get("X-MSTR-AuthToken")
+        if not self.auth_token:
+            raise RuntimeError("Login response did not include an auth token")
+        self.session.headers.update({"X-MSTR-AuthToken": self.auth_token})
+        self.last_activity = time.time()
+        self._credentials = (username, password)
+    
+    def refresh_session(self, username, password, log):
+        """
+        Refresh the session by logging in again, reporting the outcome through log
+        Returns: True if the login succeeded
+        """
         try:
-            response = self.session.post(url, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            # Extract token from headers
-            self.auth_token = response.headers.get("X-MSTR-AuthToken")
-            if self.auth_token:
-                self.session.headers.update({"X-MSTR-AuthToken": self.auth_token})
-                self.last_activity = time.time()
-                return True
-            return False
+            self.login(username, password)
         except Exception as e:
-            st.error(f"Login error: {str(e)}")
+            log(f"⚠️ Failed to refresh session: {str(e)}")
             return False
+        log("Session refreshed successfully")
+        return True
     
-    def refresh_session(self, username, password):
-        """Refresh the session by logging in again"""
-        st.warning("Refreshing session...")
-        time.sleep(2)  # Brief delay before retry
-        success = self.login(username, password)
-        if success:
-            st.success("Session refreshed successfully!")
-        else:
-            st.error("Failed to refresh session")
-        return success
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request, logging in again and retrying once if the token has expired
+        (a failed re-login raises, so the caller reports it with its other errors)
+        Returns: requests.Response
+        """
+        token = self.auth_token
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 401 and self._credentials:
+            with self._login_lock:
+                # Another worker may already have renewed the token
+                if self.auth_token == token:
+                    self.login(*self._credentials)
+            response = self.session.request(method, url, **kwargs)
+        return response
     
-    def check_session_age(self, username, password, max_age=900):
+    def check_session_age(self, username, password, log, max_age=900):
         """Check if session needs refreshing (15 minutes by default)"""
-        current_time = time.time()
-        if current_time - self.last_activity > max_age:
-            return self.refresh_session(username, password)
+        if time.time() - self.last_activity > max_age:
+            with self._login_lock:
+                # Another worker may already have refreshed it
+                if time.time() - self.last_activity > max_age:
+                    return self.refresh_session(username, password, log=log)
         return True
         
-    def submit_question(self, question_text, username, password, max_retries=3):
-        """Submit new question and return question ID with retries"""
-        url = f"{self.base_url}/api/questions"
-        headers = {
-            "Prefer": "respond-async",
-            "X-MSTR-ProjectID": self.project_id
-        }
-        payload = {
-            "text": question_text,
-            "textOnly": True,
-            "bots": [{
-                "id": self.bot_id,
-                "projectId": self.project_id
-            }],
-            "history": []
-        }
+    def submit_question(self, question_text, username, password, log, max_retries=3):
+        """
+        Submit new question and return question ID with retries
+        Retry messages go to log, so failing runs don't add elements to the page.
+        """
+        url = self._questions_url
+        payload = {**self._submit_payload_template, "text": question_text}
         
         retries = 0
         while retries <= max_retries:
             try:
-                # Always check session before submitting
-                if retries > 0 or not self.check_session_age(username, password):
-                    self.refresh_session(username, password)
+                # Log in again if the session has been idle too long; an expired
+                # token is otherwise renewed by _send on a 401
+                self.check_session_age(username, password, log=log)
                 
-                response = self.session.post(url, headers=headers, json=payload, timeout=30)
+                response = self._send("POST", url, headers=self._submit_headers, data=json_dumps(payload), timeout=30)
                 response.raise_for_status()
                 self.last_activity = time.time()
-                return response.json()["id"]
+                return json_loads(response.content)["id"]
             except requests.exceptions.HTTPError as e:
                 retries += 1
-                st.warning(f"HTTP error when submitting question (attempt {retries}/{max_retries+1}): {str(e)}")
+                log(f"⚠️ HTTP error when submitting \"{question_text}\" (attempt {retries}/{max_retries+1}): {str(e)}")
                 if retries <= max_retries:
-                    time.sleep(2 * retries)  # Exponential backoff
+                    # Exponential backoff, or longer if a throttled server asked for it
+                    time.sleep(max(2 * retries, retry_after_seconds(e.response) or 0))
                     continue
                 else:
                     raise
             except Exception as e:
                 retries += 1
-                st.warning(f"Error submitting question (attempt {retries}/{max_retries+1}): {str(e)}")
+                log(f"⚠️ Error submitting \"{question_text}\" (attempt {retries}/{max_retries+1}): {str(e)}")
                 if retries <= max_retries:
                     time.sleep(2 * retries)  # Exponential backoff
                     continue
@@ -223,194 +422,270 @@ class ChatbotClient:
         
         raise Exception("Maximum retries exceeded when submitting question")
         
-    def poll_answer(self, question_id, timeout=55, interval=1):
+    def poll_answer(self, question_id, log, timeout=55, initial_interval=0.25, max_interval=5.0, backoff_factor=1.5,
+                    long_poll_wait=30, cancel_event=None):
         """
         Poll for answer with basic first response timing
+        Polls back off exponentially until the first 200 response; after that each poll
+        asks the server to hold the request until the answer is ready (long polling).
+        Setting cancel_event stops polling early. Polling errors go to log.
         Returns: (response_data, time_to_first_response, total_response_time)
         """
         start_time = time.time()
         url = f"{self.base_url}/api/questions/{question_id}"
         first_response_time = None
+        interval = initial_interval
+        last_error = None
         
-        # Try to get initial response quickly (shorter intervals)
-        for _ in range(30):  # Try for 3 seconds (30 * 0.1)
-            if time.time() - start_time > timeout:
-                raise TimeoutError("Polling timed out")
-                
-            try:
-                response = self.session.get(url, timeout=10)
-                
-                # If we get any response with status 200, mark first response time
-                if response.status_code == 200:
-                    first_response_time = time.time() - start_time
-                    break
-            except:
-                pass  # Ignore errors during quick polling
-                
-            time.sleep(0.1)
-        
-        # If we still don't have first response time, set it equal to whenever we get the final answer
-        if first_response_time is None:
-            first_response_time = time.time() - start_time
-            
-        # Continue polling until completion
+        # Poll until completion
         while (time.time() - start_time) < timeout:
+            if cancel_event is not None and cancel_event.is_set():
+                raise Exception("Polling cancelled")
+            server_delay = None
+            headers = None
+            request_timeout = 10
+            if first_response_time is not None:
+                # Let the server hold the request open, but not past the overall timeout
+                hold = max(1, min(long_poll_wait, int(timeout - (time.time() - start_time))))
+                headers = {"Prefer": f"wait={hold}"}
+                request_timeout = hold + 10
             try:
-                response = self.session.get(url, timeout=10)
+                response = self._send("GET", url, headers=headers, timeout=request_timeout)
                 if response.status_code == 200:
-                    data = response.json()
-                    # Check if we have a complete answer
-                    if "answers" in data and len(data["answers"]) > 0:
-                        # Consider it complete if it has answer text
-                        if "text" in data["answers"][0] and data["answers"][0]["text"]:
+                    # The first response with status 200 marks the first response time
+                    if first_response_time is None:
+                        first_response_time = time.time() - start_time
+                        # The answer is being written now, so poll quickly again
+                        interval = initial_interval
+                    body = response.content
+                    # Skip decoding bodies that can't hold answer text yet
+                    if b'"answers"' in body and b'"text"' in body:
+                        data = json_loads(body)
+                        # Consider it complete if the first answer has answer text
+                        answers = data.get("answers")
+                        if answers and answers[0].get("text"):
                             self.last_activity = time.time()
                             return data, first_response_time, time.time() - start_time
                 
                 elif response.status_code != 202:
+                    # Throttled or briefly unavailable: wait as long as the server asks (capped)
+                    server_delay = retry_after_seconds(response)
                     response.raise_for_status()
             except Exception as e:
-                # Log error but continue polling
-                print(f"Error during polling: {str(e)}")
+                # Log error but continue polling (a repeated error is only logged once)
+                if str(e) != last_error:
+                    last_error = str(e)
+                    log(f"⚠️ Error while polling question {question_id}: {str(e)}")
         
-            time.sleep(interval)
+            # Back off exponentially (0.25s, 0.375s, 0.56s... capped) without sleeping past the timeout
+            delay = max(0, min(max(interval, server_delay or 0), timeout - (time.time() - start_time)))
+            if cancel_event is not None:
+                cancel_event.wait(delay)  # Wakes early if the run is stopped
+            else:
+                time.sleep(delay)
+            interval = min(interval * backoff_factor, max_interval)
         
         raise TimeoutError(f"Polling timed out after {timeout} seconds")
         
     def extract_data_from_response(self, response_data):
         """
-        Extract interpretation, SQL, and insights from the response.
-        Returns: (interpretation, sql, insights)
+        Extract answer text, interpretation, SQL, and insights from the response.
+        Returns: (answer_text, interpretation, sql, insights)
         """
-        interpretation = ""
-        sql = ""
         insights = ""
+        answer = (response_data.get("answers") or [{}])[0]
         
-        if "answers" in response_data and len(response_data["answers"]) > 0:
-            answer = response_data["answers"][0]
-            
-            # Extract SQL queries
-            if "sqlQueries" in answer and len(answer["sqlQueries"]) > 0:
-                sql = answer["sqlQueries"][0]
-            
-            # Extract interpretation from queries
-            if "queries" in answer and len(answer["queries"]) > 0:
-                query = answer["queries"][0]
-                if "explanation" in query:
-                    interpretation = query["explanation"]
-            
-            # Extract insights if available
-            if "insights" in answer:
-                # Handle insights based on data structure (could be string or object)
-                if isinstance(answer["insights"], str):
-                    insights = answer["insights"]
-                elif isinstance(answer["insights"], list) and len(answer["insights"]) > 0:
-                    # If it's a list of objects, try to extract text from each
-                    insights_texts = []
-                    for insight in answer["insights"]:
-                        if isinstance(insight, str):
-                            insights_texts.append(insight)
-                        elif isinstance(insight, dict) and "text" in insight:
-                            insights_texts.append(insight["text"])
-                    insights = "\n".join(insights_texts)
+        # Extract answer text
+        answer_text = answer.get("text", "No answer provided")
         
-        return interpretation, sql, insights
+        # Extract SQL queries
+        sql = (answer.get("sqlQueries") or [""])[0]
+        
+        # Extract interpretation from queries
+        interpretation = (answer.get("queries") or [{}])[0].get("explanation", "")
+        
+        # Extract insights if available
+        raw_insights = answer.get("insights")
+        # Handle insights based on data structure (could be string or object)
+        if isinstance(raw_insights, str):
+            insights = raw_insights
+        elif isinstance(raw_insights, list) and raw_insights:
+            # If it's a list of objects, try to extract text from each
+            insights = "\n".join(
+                insight if isinstance(insight, str) else insight["text"]
+                for insight in raw_insights
+                if isinstance(insight, str) or (isinstance(insight, dict) and "text" in insight)
+            )
+        
+        return answer_text, interpretation, sql, insights
+
+# Header names that mark the question column
+POSSIBLE_HEADERS = frozenset(["question", "questions", "query", "queries"])
 
 # Parse the CSV file to extract questions - fixed for binary file handling
-def parse_questions_from_csv(file):
+@st.cache_data(show_spinner=False)  # Reruns with the same upload skip re-parsing
+def parse_questions_from_csv(file_bytes):
     questions = []
     
-    # Reset file pointer to beginning
-    file.seek(0)
-    
     try:
-        # Convert bytes to string for CSV reader
-        text_content = io.TextIOWrapper(file, encoding='utf-8')
+        # Decode the whole upload once for the CSV reader; Excel exports often start
+        # with a BOM, and files that aren't UTF-8 are read as Latin-1
+        try:
+            text = file_bytes.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = file_bytes.decode('latin-1')
+        text_content = io.StringIO(text, newline='')
         csv_reader = csv.reader(text_content)
-        rows = list(csv_reader)
+        # Peek at the first row, then stream the rest in a single pass
+        first_row = next(csv_reader, None)
         
         # If we have at least one row
-        if rows:
+        if first_row is not None:
             # Check if the first row looks like a header
-            first_row = rows[0]
-            possible_headers = ["question", "questions", "query", "queries"]
-            header_index = -1
-            
-            for i, cell in enumerate(first_row):
-                if cell.lower() in possible_headers:
-                    header_index = i
-                    break
+            header_index = next((i for i, cell in enumerate(first_row) if cell.lower() in POSSIBLE_HEADERS), -1)
                     
-            # If we found a header, use that column from row 1 onwards
-            if header_index >= 0:
-                for row in rows[1:]:
-                    if len(row) > header_index and row[header_index].strip():
-                        questions.append(row[header_index].strip())
-            else:
+            if header_index < 0:
                 # No header found, assume first column has questions including first row
-                for row in rows:
-                    if row and row[0].strip():
-                        questions.append(row[0].strip())
+                header_index = 0
+                if first_row and first_row[0].strip():
+                    questions.append(first_row[0].strip())
+            # Take that column from the remaining rows
+            for row in csv_reader:
+                if len(row) > header_index and row[header_index].strip():
+                    questions.append(row[header_index].strip())
                         
     except Exception as e:
         st.error(f"Error reading CSV file: {str(e)}")
-        # If CSV reading fails, try pandas as fallback
-        try:
-            file.seek(0)
-            csv_data = pd.read_csv(file)  # Pandas handles binary files automatically
-            # If we have at least one column, take the first column
-            if len(csv_data.columns) > 0:
-                questions = csv_data.iloc[:, 0].dropna().tolist()
-        except Exception as inner_e:
-            st.error(f"Fallback CSV reading also failed: {str(inner_e)}")
     
     return questions
 
-# Function to create a downloadable CSV
-def create_download_csv(df):
-    # Create a CSV string from the DataFrame
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_string = csv_buffer.getvalue()
+# Function to get a logged-in client, reused across reruns
+@st.cache_resource(show_spinner=False)
+def get_client(base_url, bot_id, project_id, username, password, pool_size):
+    """
+    Create a client and log in. Raises on failure so a failed login is not cached.
+    Returns: logged-in ChatbotClient
+    """
+    client = ChatbotClient(base_url, bot_id, project_id, pool_size=pool_size)
+    try:
+        client.login(username, password)
+    except Exception as e:
+        raise RuntimeError(f"Login failed ({str(e)}). Please check your credentials.") from e
+    return client
+
+# Forget the saved client so the next run opens a new session and logs in
+if relogin_clicked:
+    get_client.clear()
+    st.info("Saved session cleared. The next run will log in again.")
+
+# Function to turn a result row into CSV values
+def csv_row(values):
+    """
+    Round the timings in a row of values given in COLUMNS order
+    Returns: list of CSV values
+    """
+    return [round(value, 2) if column in TIME_COLUMNS else value for column, value in zip(COLUMNS, values)]
+
+# Function to prepare the results CSV file for a download button
+def package_download(csv_file):
+    """
+    Read the CSV bytes written so far and gzip-compress them if the user asked for it
+    Returns: (data, file extension, MIME type)
+    """
+    raw = csv_file.buffer
+    raw.seek(0)
+    csv_bytes = raw.read()
+    raw.seek(0, io.SEEK_END)  # Later rows are appended
+    if compress_downloads:
+        return gzip.compress(csv_bytes), "csv.gz", "application/gzip"
     
     # Return the CSV data
-    return csv_string
+    return csv_bytes, "csv", "text/csv"
 
 # Function to save checkpoint
-def save_checkpoint(progress_idx, df):
+def save_checkpoint(progress_idx, columns, csv_file):
     st.session_state.questions_processed = progress_idx
-    st.session_state.results_df = df.copy()
+    st.session_state.results_columns = columns
+    # A resumed run writes a new file that replaces the previous run's
+    if st.session_state.results_csv is not None and st.session_state.results_csv is not csv_file:
+        st.session_state.results_csv.close()
+    st.session_state.results_csv = csv_file
+
+# Function to process a single question (runs on a worker thread)
+def process_question(client, question, rate_limiter, cache, cancel_event, log):
+    """
+    Submit a question, poll for its answer and extract the response fields.
+    Answers from earlier runs are taken from the cache without calling the bot,
+    unless the user chose to ignore cached answers. Cache failures never fail the question.
+    Submission retry and polling error messages are passed to log (the run log) instead of the page.
+    Returns: dict with answer, insights, interpretation, SQL and timings
+    """
+    cached = None
+    cache_error = ""
+    if cache is not None and not ignore_cache:
+        try:
+            cached = cache.get(question)
+        except (sqlite3.Error, ValueError) as e:
+            cache_error = f"read failed: {str(e)}"
+    if cached is not None:
+        result, first_response_time, total_response_time, cached_at = cached
+    else:
+        # Wait for our turn under the submission rate limit, if there is one
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+
+        # Don't start new questions once the run has been stopped
+        if cancel_event.is_set():
+            raise Exception("Run stopped before this question was submitted")
+
+        # Submit question with retry logic
+        question_id = client.submit_question(question, username, password, log=log)
+
+        # Poll for answer with timing information (will timeout after 55 seconds)
+        result, first_response_time, total_response_time = client.poll_answer(question_id, log=log, cancel_event=cancel_event)
+        if cache is not None:
+            try:
+                cache.set(question, result, first_response_time, total_response_time)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                cache_error = f"write failed: {str(e)}"
+        cached_at = None
+
+    # Extract data
+    answer_text, interpretation, sql, insights = client.extract_data_from_response(result)
+
+    # Analyze SQL complexity and get estimated latency (answers without SQL skip the analysis)
+    latency, complexity = analyze_sql_complexity(sql) if sql else (0.5, "No SQL")
+
+    return {
+        "answer_text": answer_text,
+        "interpretation": interpretation,
+        "sql": sql,
+        "insights": insights,
+        "first_response_time": first_response_time,
+        "total_response_time": total_response_time,
+        "latency": latency,
+        "complexity": complexity,
+        # Calculate estimated time to first response
+        "estimated_first_response": first_response_time + latency,
+        "cached": cached is not None,
+        "cached_at": cached_at,
+        "cache_error": cache_error
+    }
 
 # Run queries function with checkpointing
 def run_queries(questions_list, start_index=0):
-    # Create or load results DataFrame with additional assessment columns
-    if st.session_state.results_df is not None and start_index > 0:
-        results_df = st.session_state.results_df
+    # Collect one list per column so pandas builds each DataFrame column in one go
+    if st.session_state.results_columns is not None and start_index > 0:
+        results = st.session_state.results_columns
         st.info(f"Resuming from question {start_index+1}/{len(questions_list)}")
     else:
-        results_df = pd.DataFrame(columns=[
-            "Question",
-            "Answer",
-            "Insights",
-            "Interpretation",
-            "SQL",
-            "API Response Time (seconds)",
-            "Total Response Time (seconds)",
-            "Estimated Time to First Response (seconds)",
-            "Question Difficulty (1-5)",
-            "Pass/Fail",
-            "Answer Accuracy (1-5)"
-        ])
+        results = {column: [] for column in COLUMNS}
     
-    # Initialize client
-    client = ChatbotClient(base_url, bot_id, project_id)
-
-    # Login
+    # Initialize client, reusing the logged-in session from earlier runs
     with st.spinner("Logging in..."):
         try:
-            login_success = client.login(username, password)
-            if not login_success:
-                st.error("Login failed. Please check your credentials.")
-                return None
+            client = get_client(base_url, bot_id, project_id, username, password, max_concurrent)
+            client.check_session_age(username, password, log=st.info)
         except Exception as e:
             st.error(f"Login error: {str(e)}")
             return None
@@ -424,6 +699,13 @@ def run_queries(questions_list, start_index=0):
     # Heartbeat element to keep connection alive
     heartbeat_text = st.empty()
 
+    # Clicking Stop reruns the script, which interrupts this run; the finally
+    # block below then saves the checkpoint and tells the workers to stop.
+    # Any other widget interaction that reruns the script cancels the run the same
+    # way, so the in-run download button below is set not to rerun
+    st.button("⏹️ Stop Processing", key="stop_btn", help="Stop after saving the finished questions; resume later")
+    cancel_event = threading.Event()
+
     # Calculate initial progress percentage
     if start_index > 0:
         initial_progress = int((start_index / len(questions_list)) * 100)
@@ -433,159 +715,221 @@ def run_queries(questions_list, start_index=0):
 
     # Calculate estimated time
     total_questions = len(questions_list)
-    delay_between_questions = 15  # Reduced from 20 to improve throughput
-    estimated_time = (total_questions - start_index) * (delay_between_questions + 15)
+    remaining = total_questions - start_index
+    estimated_time = math.ceil(remaining / max_concurrent) * 15
+    if submissions_per_minute:
+        # Bound by the submission rate limit
+        estimated_time = int(max(estimated_time, (remaining - 1) * 60 / submissions_per_minute + 15))
     st.info(f"Estimated time: {estimated_time//60} minutes {estimated_time%60} seconds")
 
-    # Create a container for intermediate results
-    results_container = st.container()
+    # Single placeholder for the per-question log, updated in place
+    log_placeholder = st.empty()
+    log_entries = []
+    error_log = []  # (question number, traceback) shown once the run ends
     
     # Create a container for downloaded results
     download_container = st.container()
     with download_container:
         dl_placeholder = st.empty()
 
-    # Set processing as active
+    # Results CSV is written row by row to a temporary file as questions finish in order,
+    # so the download never re-serializes the whole table and large runs stay on disk.
+    # Rows are encoded as they are written, so downloads read the bytes directly.
+    # (TextIOWrapper only accepts a SpooledTemporaryFile from Python 3.11 on)
+    csv_file = io.TextIOWrapper(
+        tempfile.TemporaryFile(mode="w+b"),
+        encoding="utf-8", newline="", write_through=True
+    )
+    csv_writer = csv.writer(csv_file, lineterminator="\n")
+    csv_writer.writerow(COLUMNS)
+    csv_writer.writerows(map(csv_row, zip(*(results[column] for column in COLUMNS))))
+
+    # Questions finish out of order, so finished rows wait here until every
+    # earlier question is done to keep the results and checkpoint in order
+    finished_rows = {}
+    next_index = start_index
+    completed = 0
+    last_ui_update = 0.0  # time.monotonic() of the last progress redraw
+    last_download_update = 0.0  # time.monotonic() of the last download button rebuild
+
+    executor = None  # Created inside the try below
+
+    # Set processing as active; everything that can fail from here on is inside
+    # the try, so the finally block always clears it again
     st.session_state.processing_active = True
 
-    # Process each question
+    # Process the questions concurrently
     try:
+        # Space out submissions across all workers (0 means no limit)
+        rate_limiter = RateLimiter(submissions_per_minute) if submissions_per_minute else None
+
+        # Answers saved by earlier runs of this user against this bot; the run
+        # goes on without reusing or saving answers if the cache can't be opened
+        try:
+            cache = ResponseCache(base_url, project_id, bot_id, username)
+        except (sqlite3.Error, OSError) as e:
+            cache = None
+            log_entries.append(f"⚠️ Response cache unavailable, answers will not be reused or saved: {str(e)}")
+
+        # Worker threads share the logged-in client; they never touch the page
+        # themselves, and report through the run log instead
+        executor = ThreadPoolExecutor(max_workers=max_concurrent)
+
+        # Repeated questions are only sent once; their answer fills every position
+        positions = {}
         for i in range(start_index, len(questions_list)):
-            question = questions_list[i]
-            
-            # Update heartbeat
-            current_time = datetime.now().strftime("%H:%M:%S")
-            heartbeat_text.info(f"Heartbeat: {current_time} - Processing question {i+1}/{total_questions}")
-            
-            # Update progress
-            progress = int(((i + 1) / total_questions) * 100)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing question {i+1}/{total_questions}: {question}")
+            positions.setdefault(questions_list[i], []).append(i)
+        futures = {
+            executor.submit(process_question, client, question, rate_limiter, cache, cancel_event,
+                            log_entries.append): indices
+            for question, indices in positions.items()
+        }
+        status_text.text(f"Submitted {len(futures)} unique questions ({max_concurrent} at a time)...")
+
+        # Wait in short ticks instead of blocking until the next question finishes, so the
+        # page is touched at least every half second and a Stop click is noticed right away
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if not done:
+                heartbeat_text.info(f"Heartbeat: {datetime.now():%H:%M:%S} - Completed {start_index + completed}/{total_questions} questions")
+                continue
 
-            # Try to refresh token periodically
-            if i > start_index and i % 3 == 0:
+            for future in done:
+                indices = futures[future]
+                i = indices[0]
+                question = questions_list[i]
+                completed += len(indices)
+            
                 try:
-                    client.refresh_session(username, password)
-                except:
-                    pass  # Continue even if refresh fails
+                    answer = future.result()
 
-            try:
-                # Submit question with retry logic
-                question_id = client.submit_question(question, username, password)
-                
-                # Poll for answer with timing information (will timeout after 55 seconds)
-                result, first_response_time, total_response_time = client.poll_answer(question_id)
-                
-                # Extract data
-                answer_text = result["answers"][0]["text"] if "answers" in result and len(result["answers"]) > 0 else "No answer provided"
-                interpretation, sql, insights = client.extract_data_from_response(result)
-                
-                # Analyze SQL complexity and get estimated latency
-                latency, complexity = analyze_sql_complexity(sql)
-                
-                # Calculate estimated time to first response
-                estimated_first_response = first_response_time + latency
+                    # Reused answers keep the timings measured when they were saved
+                    if answer["cached_at"]:
+                        cached_at = f"{datetime.fromtimestamp(answer['cached_at']):%Y-%m-%d %H:%M:%S}"
+                    else:
+                        cached_at = "unknown" if answer["cached"] else ""  # Saved by an older cache without timestamps
                 
-                # Add to DataFrame with empty assessment columns
-                results_df.loc[len(results_df)] = [
-                    question,
-                    answer_text,
-                    insights,
-                    interpretation,
-                    sql,
-                    round(first_response_time, 2),
-                    round(total_response_time, 2),
-                    round(estimated_first_response, 2),
-                    "",  # Question Difficulty - left empty for user to fill
-                    "",  # Pass/Fail - left empty for user to fill
-                    ""   # Answer Accuracy - left empty for user to fill
-                ]
+                    # Add to results with empty assessment columns
+                    row = {
+                        "Question": question,
+                        "Answer": answer["answer_text"],
+                        "Insights": answer["insights"],
+                        "Interpretation": answer["interpretation"],
+                        "SQL": answer["sql"],
+                        "API Response Time (seconds)": answer["first_response_time"],
+                        "Total Response Time (seconds)": answer["total_response_time"],
+                        "Estimated Time to First Response (seconds)": answer["estimated_first_response"],
+                        "Cached At": cached_at,
+                        "Question Difficulty (1-5)": "",  # Left empty for user to fill
+                        "Pass/Fail": "",  # Left empty for user to fill
+                        "Answer Accuracy (1-5)": ""   # Left empty for user to fill
+                    }
                 
-                with results_container:
-                    st.success(f"""✓ Got answer for question {i+1}:
-                    - API Response Time: {first_response_time:.2f}s
-                    - Total Response Time: {total_response_time:.2f}s
-                    - SQL Complexity: {complexity} (+{latency:.1f}s)
-                    - Estimated Time to First Response: {estimated_first_response:.2f}s""")
+                    if answer["cache_error"]:
+                        log_entries.append(f"⚠️ Response cache {answer['cache_error']} (question {i+1})")
+                    cached_note = f" (cached {cached_at})" if cached_at else ""
+                    log_entries.append(
+                        f"✓ Got answer for question {i+1}{cached_note}: "
+                        f"API Response Time {answer['first_response_time']:.2f}s, "
+                        f"Total Response Time {answer['total_response_time']:.2f}s, "
+                        f"SQL Complexity {answer['complexity']} (+{answer['latency']:.1f}s), "
+                        f"Estimated Time to First Response {answer['estimated_first_response']:.2f}s"
+                    )
                 
-            except TimeoutError as e:
-                # Handle timeout specifically
-                with results_container:
-                    st.warning(f"⚠️ Question {i+1} timed out after 55 seconds. Skipping to next question.")
+                except TimeoutError as e:
+                    # Handle timeout specifically
+                    log_entries.append(f"⚠️ Question {i+1} timed out after 55 seconds. Skipping to next question.")
                 
-                # Add timeout to DataFrame with empty assessment columns
-                results_df.loc[len(results_df)] = [
-                    question,
-                    "TIMEOUT: Question processing exceeded 55 seconds",
-                    "",
-                    "",
-                    "",
-                    55,  # Set to timeout value
-                    55,  # Set to timeout value
-                    55,  # Set to timeout value
-                    "",  # Question Difficulty
-                    "Skip",  # Mark as skipped
-                    ""   # Answer Accuracy
-                ]
+                    # Add timeout to results with empty assessment columns
+                    row = {
+                        "Question": question,
+                        "Answer": "TIMEOUT: Question processing exceeded 55 seconds",
+                        "Insights": "",
+                        "Interpretation": "",
+                        "SQL": "",
+                        "API Response Time (seconds)": 55,  # Set to timeout value
+                        "Total Response Time (seconds)": 55,  # Set to timeout value
+                        "Estimated Time to First Response (seconds)": 55,  # Set to timeout value
+                        "Cached At": "",
+                        "Question Difficulty (1-5)": "",
+                        "Pass/Fail": "Skip",  # Mark as skipped
+                        "Answer Accuracy (1-5)": ""
+                    }
                 
-                # Try to refresh the session after a timeout
-                try:
-                    client.refresh_session(username, password)
-                except:
-                    pass  # Continue even if refresh fails
+                except Exception as e:
+                    # Get detailed error information
+                    error_details = traceback.format_exc()
+                    log_entries.append(f"❌ Error processing question {i+1}: {str(e)}")
+                    error_log.append((i+1, error_details))
                 
-            except Exception as e:
-                # Get detailed error information
-                error_details = traceback.format_exc()
-                with results_container:
-                    st.error(f"Error processing question {i+1}: {str(e)}")
-                    st.code(error_details, language="python")
+                    # Add error to results with empty assessment columns
+                    row = {
+                        "Question": question,
+                        "Answer": f"ERROR: {str(e)}",
+                        "Insights": "",
+                        "Interpretation": "",
+                        "SQL": "",
+                        "API Response Time (seconds)": 0,
+                        "Total Response Time (seconds)": 0,
+                        "Estimated Time to First Response (seconds)": 0,
+                        "Cached At": "",
+                        "Question Difficulty (1-5)": "",
+                        "Pass/Fail": "Fail",  # Auto-fill as fail since there was an error
+                        "Answer Accuracy (1-5)": ""
+                    }
+
+                for j in indices:
+                    finished_rows[j] = dict(row)
+
+                # Update heartbeat, progress and log at most ~4 times a second, and
+                # always for the last question, so fast completions don't flood the browser
+                now = time.monotonic()
+                if now - last_ui_update >= 0.25 or start_index + completed == total_questions:
+                    last_ui_update = now
+                    current_time = datetime.now().strftime("%H:%M:%S")
+                    heartbeat_text.info(f"Heartbeat: {current_time} - Completed {start_index + completed}/{total_questions} questions")
                 
-                # Add error to DataFrame with empty assessment columns
-                results_df.loc[len(results_df)] = [
-                    question,
-                    f"ERROR: {str(e)}",
-                    "",
-                    "",
-                    "",
-                    0,
-                    0,
-                    0,
-                    "",  # Question Difficulty
-                    "Fail",  # Auto-fill as fail since there was an error
-                    ""   # Answer Accuracy
-                ]
+                    progress = int(((start_index + completed) / total_questions) * 100)
+                    progress_bar.progress(progress)
+                    status_text.text(f"Finished question {i+1}/{total_questions}: {question}")
                 
-                # Try to refresh the session after an error
-                try:
-                    client.refresh_session(username, password)
-                except:
-                    pass  # Continue even if refresh fails
-            
-            # Save checkpoint after each question
-            save_checkpoint(i+1, results_df)
+                    # Show the latest log entries
+                    log_placeholder.markdown("\n".join(f"- {entry}" for entry in log_entries[-10:]))
+
+                # Move every row that is now in order into the results
+                flushed = next_index
+                while next_index in finished_rows:
+                    row = finished_rows.pop(next_index)
+                    values = [row[column] for column in COLUMNS]
+                    for column, value in zip(COLUMNS, values):
+                        results[column].append(value)
+                    csv_writer.writerow(csv_row(values))
+                    next_index += 1
+                if next_index == flushed:
+                    continue  # Still waiting on an earlier question
+
+                # Save checkpoint after each question (cheap: it keeps references)
+                save_checkpoint(next_index, results, csv_file)
             
-            # Update download link after each question
-            with download_container:
-                # Generate CSV file for download (includes all columns)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                csv_data = create_download_csv(results_df)
-                
-                dl_placeholder.download_button(
-                    label=f"📥 Download CSV Results ({i+1}/{total_questions} questions)",
-                    data=csv_data,
-                    file_name=f"bot_queries_{timestamp}.csv",
-                    mime="text/csv",
-                    key=f"download_btn_{i}_{timestamp}"
-                )
+                # Update download link at most ~4 times a second, and always once everything is in
+                now = time.monotonic()
+                if now - last_download_update < 0.25 and next_index < total_questions:
+                    continue
+                last_download_update = now
+                with download_container:
+                    # Generate CSV file for download (includes all columns)
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    csv_data, extension, mime = package_download(csv_file)
                 
-                # Force Streamlit to redraw by introducing a small delay
-                time.sleep(0.1)
-
-            # Delay before next question - reduced delay for better efficiency
-            if i < len(questions_list) - 1:
-                status_text.text(f"Waiting {delay_between_questions} seconds before next question...")
-                time.sleep(delay_between_questions)
+                    dl_placeholder.download_button(
+                        label=f"📥 Download CSV Results ({next_index}/{total_questions} questions)",
+                        data=csv_data,
+                        file_name=f"bot_queries_{timestamp}.{extension}",
+                        mime=mime,
+                        key=f"download_btn_{completed}_{timestamp}",
+                        on_click="ignore"  # Downloading must not rerun the script and stop the run
+                    )
     
     except Exception as e:
         # Handle any unexpected errors
@@ -593,17 +937,32 @@ def run_queries(questions_list, start_index=0):
         st.code(traceback.format_exc(), language="python")
     
     finally:
-        # Set processing as inactive
+        # Drop questions that haven't started if the run was interrupted. Questions
+        # still polling stop once their current request returns (requests already
+        # in flight can't be aborted), and the workers are not waited for
+        cancel_event.set()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # Final save and set processing as inactive, before touching the page
+        save_checkpoint(next_index, results, csv_file)
         st.session_state.processing_active = False
         
-        # Update progress to 100%
-        progress_bar.progress(100)
-        status_text.text("All questions processed!")
-        
-        # Final save
-        save_checkpoint(len(questions_list), results_df)
+        # Only a run that got through every question is shown as complete
+        if next_index == total_questions:
+            progress_bar.progress(100)
+            status_text.text("All questions processed!")
+        else:
+            status_text.text(f"Stopped after {next_index}/{total_questions} questions; resume to continue")
+
+    # Render the full run log once, with details for any errors
+    with st.expander(f"Run log ({len(log_entries)} entries)"):
+        st.markdown("\n".join(f"- {entry}" for entry in log_entries))
+        for question_number, error_details in error_log:
+            st.markdown(f"**Error details for question {question_number}**")
+            st.code(error_details, language="python")
 
-    return results_df
+    return results
 
 # Add custom CSS styling for your interface
 st.markdown("""
@@ -618,14 +977,16 @@ st.markdown("""
 
 # Main app logic
 if uploaded_file is not None:
-    # Parse questions from the uploaded CSV
-    questions_list = parse_questions_from_csv(uploaded_file)
-    
-    # Store questions in session state
-    if questions_list and len(questions_list) > 0 and questions_list != st.session_state.questions_list:
-        st.session_state.questions_list = questions_list
-        st.session_state.questions_processed = 0  # Reset progress when questions change
-        st.session_state.total_questions = len(questions_list)
+    # Parse questions only when a different file is uploaded; other reruns reuse the stored list
+    if uploaded_file.file_id != st.session_state.questions_file_id:
+        st.session_state.questions_file_id = uploaded_file.file_id
+        questions_list = parse_questions_from_csv(uploaded_file.getvalue())
+        
+        # Store questions in session state
+        if questions_list and len(questions_list) > 0 and questions_list != st.session_state.questions_list:
+            st.session_state.questions_list = questions_list
+            st.session_state.questions_processed = 0  # Reset progress when questions change
+            st.session_state.total_questions = len(questions_list)
     
     if st.session_state.questions_list:
         st.write(f"Found {len(st.session_state.questions_list)} questions in the CSV file")
@@ -643,21 +1004,21 @@ if uploaded_file is not None:
             st.info(f"Progress: {st.session_state.questions_processed}/{st.session_state.total_questions} questions processed")
             
             # Show partial results
-            if st.session_state.results_df is not None:
+            if st.session_state.results_columns is not None and st.session_state.results_csv is not None:
                 st.subheader("Current Results")
-                display_df = st.session_state.results_df.drop(columns=["Question Difficulty (1-5)", "Pass/Fail", "Answer Accuracy (1-5)"])
-                st.dataframe(display_df, use_container_width=True)
+                st.dataframe(pd.DataFrame(st.session_state.results_columns, columns=COLUMNS), use_container_width=True,
+                             column_order=DISPLAY_COLUMNS, column_config=DISPLAY_CONFIG)
                 
                 # Generate CSV file for download
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                csv_data = create_download_csv(st.session_state.results_df)
+                csv_data, extension, mime = package_download(st.session_state.results_csv)
                 
                 # Create download button for intermediate results
                 st.download_button(
                     label=f"📥 Download Partial Results ({st.session_state.questions_processed}/{st.session_state.total_questions} questions)",
                     data=csv_data,
-                    file_name=f"bot_queries_partial_{timestamp}.csv",
-                    mime="text/csv",
+                    file_name=f"bot_queries_partial_{timestamp}.{extension}",
+                    mime=mime,
                     key="download_partial"
                 )
         
@@ -677,13 +1038,16 @@ if uploaded_file is not None:
                         st.error("Please enter your username and password")
                     else:
                         # Run queries and resume from checkpoint
-                        results_df = run_queries(st.session_state.questions_list, st.session_state.questions_processed)
+                        results = run_queries(st.session_state.questions_list, st.session_state.questions_processed)
                 
                 if restart_button:
                     # Reset progress
                     st.session_state.questions_processed = 0
-                    st.session_state.results_df = None
-                    st.experimental_rerun()
+                    st.session_state.results_columns = None
+                    if st.session_state.results_csv is not None:
+                        st.session_state.results_csv.close()
+                    st.session_state.results_csv = None
+                    st.rerun()
             else:
                 run_button = st.button("▶️ Run Queries", key="run_btn")
                 
@@ -692,24 +1056,24 @@ if uploaded_file is not None:
                         st.error("Please enter your username and password")
                     else:
                         # Run queries from the beginning
-                        results_df = run_queries(st.session_state.questions_list)
+                        results = run_queries(st.session_state.questions_list)
                         
-                        if results_df is not None and len(results_df) == st.session_state.total_questions:
+                        if results is not None and len(results["Question"]) == st.session_state.total_questions:
                             # Display final results (hide assessment columns in the display)
-                            display_df = results_df.drop(columns=["Question Difficulty (1-5)", "Pass/Fail", "Answer Accuracy (1-5)"])
                             st.subheader("Final Results")
-                            st.dataframe(display_df, use_container_width=True)
+                            st.dataframe(pd.DataFrame(results, columns=COLUMNS), use_container_width=True,
+                                         column_order=DISPLAY_COLUMNS, column_config=DISPLAY_CONFIG)
                             
                             # Generate CSV file for download (includes all columns)
                             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            csv_data = create_download_csv(results_df)
+                            csv_data, extension, mime = package_download(st.session_state.results_csv)
                             
                             # Create download button for CSV with custom styling
                             st.download_button(
                                 label="📥 Download CSV Results (includes assessment columns)",
                                 data=csv_data,
-                                file_name=f"bot_queries_{timestamp}.csv",
-                                mime="text/csv",
+                                file_name=f"bot_queries_{timestamp}.{extension}",
+                                mime=mime,
                                 key="download_final"
                             )
                             